@@ -1,13 +1,15 @@
 import os
-from typing import List, Optional
+import asyncio
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
 from pydantic_ai import Agent
 from pydantic_ai.tools import RunContext
 from pydantic_ai.models.openai import OpenAIModel
 
 from models import VideoMeta, Chunk, Deps, Scope
 from services import (get_transcript_text, get_video_meta, normalize_tags, chunk_text, 
-    embed_texts, upsert_chunks, search_videos_by_tags, discover_by_tags_and_channel,
-    list_channel_uploads, query)
+    embed_texts, embed_query, embed_queries, upsert_chunks, search_videos_by_tags, discover_by_tags_and_channel,
+    list_channel_uploads, query, query_many, EMBED_BATCH_SIZE)
 from qdrant_client.models import Filter, FieldCondition, MatchAny, MatchValue
 
 
@@ -19,47 +21,140 @@ Use retrieved chunks and cite titles with links. If insufficient evidence, say s
 
 
 MODEL_NAME = "gpt-5"
+INDEX_CONCURRENCY = 5  # fetch workers; matches TranscriptRateLimiter's 5 requests / window
+EMBED_WORKERS = 2
+EMBED_PIPELINE_BATCH = EMBED_BATCH_SIZE  # texts per embeddings request when draining the embed queue
+PIPELINE_QUEUE_SIZE = 10
 rag_agent = Agent(
     model=OpenAIModel(MODEL_NAME),
     system_prompt=SYSTEM_PROMPT,
     deps_type=Deps,
 )
 
-def _jaccard(a: List[str], b: List[str]) -> float:
-    sa, sb = set(a or []), set(b or [])
-    if not sa and not sb:
-        return 0.0
-    inter = len(sa & sb)
-    union = len(sa | sb)
+def _jaccard(a: Sequence[str], b: Sequence[str]) -> float:
+    # Both inputs must be sorted and de-duplicated (as normalize_tags returns them);
+    # a two-pointer merge counts the intersection without allocating sets.
+    i = j = inter = 0
+    la, lb = len(a), len(b)
+    while i < la and j < lb:
+        if a[i] == b[j]:
+            inter += 1
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    union = la + lb - inter
     return inter / union if union else 0.0
 
 # ----- Pure, procedural functions -----
-async def index_video_id_plain(video_id: str) -> VideoMeta:
+async def _fetch_chunks(video_id: str) -> Tuple[VideoMeta, List[Chunk], List[str]]:
     print(f"[index] fetching meta for video_id={video_id}")
-    meta = get_video_meta(video_id)
-    text = get_transcript_text(video_id)
+    # SDK calls are blocking; run them in worker threads so concurrent indexing overlaps
+    meta = await asyncio.to_thread(get_video_meta, video_id)
+    text = await asyncio.to_thread(get_transcript_text, video_id)
     if not text:
         print(f"[index] no transcript for {video_id}; skipping chunk/embeddings")
-        return meta
+        return meta, [], []
     print(f"[index] transcript length={len(text)} chars for {video_id}")
+    # Loop invariants computed once; texts are kept so embedding doesn't re-walk the chunks
+    tag_set = tuple(meta.tags)  # already normalized by get_video_meta; shared by every chunk
+    vid = meta.video_id
+    texts = chunk_text(text)
     chunks = [
-        Chunk(
-            id=f"{meta.video_id}#{idx}",
-            video=meta,
-            chunk_idx=idx,
-            text=s,
-            tag_set=normalize_tags(meta.tags),
-        )
-        for idx, s in enumerate(chunk_text(text))
+        Chunk(id=f"{vid}#{idx}", video_id=vid, chunk_idx=idx, text=s, tag_set=tag_set)
+        for idx, s in enumerate(texts)
     ]
     print(f"[index] chunked into {len(chunks)} chunks for {video_id}")
+    return meta, chunks, texts
+
+async def index_video_id_plain(video_id: str) -> VideoMeta:
+    meta, chunks, texts = await _fetch_chunks(video_id)
     if chunks:
         print(f"[index] embedding {len(chunks)} chunks for {video_id}")
-        vectors = embed_texts([c.text for c in chunks])
-        upsert_chunks(chunks, vectors)
+        vectors = await asyncio.to_thread(embed_texts, texts)
+        await asyncio.to_thread(upsert_chunks, meta, chunks, vectors)
         print(f"[index] upserted {len(chunks)} chunks to vector store for {video_id}")
     return meta
 
+async def _index_many(video_ids: List[str], log_prefix: str = "[expand]") -> None:
+    # Three-stage pipeline (fetch -> embed -> upsert) so embedding/upserting earlier
+    # videos overlaps with transcript fetches for later ones. Each stage has its own
+    # worker count; bounded queues apply backpressure between stages.
+    fetch_q: asyncio.Queue = asyncio.Queue()
+    embed_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    upsert_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    for vid in video_ids:
+        fetch_q.put_nowait(vid)
+    for _ in range(INDEX_CONCURRENCY):
+        fetch_q.put_nowait(None)
+
+    async def _fetcher():
+        while (vid := await fetch_q.get()) is not None:
+            print(f"{log_prefix} indexing discovered video {vid}")
+            try:
+                meta, chunks, texts = await _fetch_chunks(vid)
+            except Exception as e:
+                print(f"{log_prefix} failed to index {vid}: {e}")
+                continue
+            if chunks:
+                await embed_q.put((meta, chunks, texts))
+
+    async def _embedder():
+        done = False
+        while not done:
+            item = await embed_q.get()
+            if item is None:
+                break
+            # Drain whatever is already queued into one request, up to EMBED_PIPELINE_BATCH texts
+            batch, n = [item], len(item[2])
+            while n < EMBED_PIPELINE_BATCH:
+                try:
+                    nxt = embed_q.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if nxt is None:
+                    done = True
+                    break
+                batch.append(nxt)
+                n += len(nxt[2])
+            texts = [t for _, _, ts in batch for t in ts]
+            print(f"{log_prefix} embedding {len(texts)} chunks from {len(batch)} videos")
+            try:
+                vectors = await asyncio.to_thread(embed_texts, texts)
+            except Exception as e:
+                print(f"{log_prefix} failed to embed {len(batch)} videos: {e}")
+                continue
+            offset = 0
+            for meta, chunks, _ in batch:
+                await upsert_q.put((meta, chunks, vectors[offset:offset + len(chunks)]))
+                offset += len(chunks)
+
+    async def _upserter():
+        while (item := await upsert_q.get()) is not None:
+            meta, chunks, vectors = item
+            vid = meta.video_id
+            try:
+                await asyncio.to_thread(upsert_chunks, meta, chunks, vectors)
+                print(f"{log_prefix} upserted {len(chunks)} chunks for {vid}")
+            except Exception as e:
+                print(f"{log_prefix} failed to upsert {vid}: {e}")
+
+    fetchers = [asyncio.create_task(_fetcher()) for _ in range(INDEX_CONCURRENCY)]
+    embedders = [asyncio.create_task(_embedder()) for _ in range(EMBED_WORKERS)]
+    upserter = asyncio.create_task(_upserter())
+    try:
+        await asyncio.gather(*fetchers)
+        for _ in embedders:
+            await embed_q.put(None)
+        await asyncio.gather(*embedders)
+        await upsert_q.put(None)
+        await upserter
+    finally:
+        for t in (*fetchers, *embedders, upserter):
+            t.cancel()
+
 async def expand_hybrid_plain(seed_video_id: str, seed_tags: List[str],
                               per_tag: int = 6, channel_max: int = 25) -> List[str]:
     # Fetch correct channel_id internally (prevents arg mixups)
@@ -67,13 +162,7 @@ async def expand_hybrid_plain(seed_video_id: str, seed_tags: List[str],
     meta = get_video_meta(seed_video_id)
     vids = discover_by_tags_and_channel(seed_video_id, seed_tags, meta.channel_id or "", per_tag, channel_max)
     print(f"[expand] discovered {len(vids)} videos")
-    for vid in vids:
-        try:
-            print(f"[expand] indexing discovered video {vid}")
-            await index_video_id_plain(vid)
-        except Exception as e:
-            print(f"[expand] failed to index {vid}: {e}")
-            pass
+    await _index_many(vids)
     return vids
 
 
@@ -84,24 +173,13 @@ async def expand_scoped_plain(scope: Scope, seed_video_id: str, seed_tags: List[
         return vids
     if scope in (Scope.SEED_PLUS_CHANNEL, Scope.ANY):
         # cheap path: uploads playlist
-        for vid in list_channel_uploads(seed_channel_id, max_results=channel_max):
-            if vid != seed_video_id:
-                vids.append(vid)
+        vids.extend(list_channel_uploads(seed_channel_id, max_results=channel_max))
     if scope in (Scope.SEED_PLUS_TAG, Scope.ANY):
-        for vid in search_videos_by_tags(seed_tags, max_per_tag=per_tag):
-            if vid != seed_video_id:
-                vids.append(vid)
-    # dedupe while preserving order
-    seen, ordered = set(), []
-    for v in vids:
-        if v not in seen:
-            seen.add(v); ordered.append(v)
+        vids.extend(search_videos_by_tags(seed_tags, max_per_tag=per_tag))
+    # dedupe while preserving order, dropping the seed
+    ordered = [v for v in dict.fromkeys(vids) if v != seed_video_id]
     # index
-    for vid in ordered:
-        try:
-            await index_video_id_plain(vid)
-        except Exception:
-            pass
+    await _index_many(ordered)
     return ordered
 
 def build_scope_filter(scope: Scope, seed_video_id: str, seed_channel_id: str,
@@ -134,27 +212,51 @@ async def expand_hybrid(ctx: RunContext[Deps], per_tag: int = 6, related_max: in
     return await expand_scoped_plain(ctx.deps.scope, seed_video_id, seed_tags, ctx.deps.seed_channel_id,
                                      per_tag=per_tag, channel_max=related_max)
 
+def _rerank(ctx: RunContext[Deps], hits, prefer_tags: Optional[List[str]],
+            log_prefix: str = "[tool.rag_search]") -> List[dict]:
+    if not ctx.deps.tag_rerank or not hits:
+        return [h.payload | {"cosine": h.score} for h in hits]
+
+    # --- Tag-aware re-rank (vectorized) ---
+    # _jaccard needs sorted, de-duplicated tags. Payload tag_set is stored normalized;
+    # prefer_tags and Deps.seed_tags come from callers, so normalize them here (cached).
+    ref_tags = normalize_tags(prefer_tags or ctx.deps.seed_tags or [])
+    alpha, beta = ctx.deps.rerank_alpha, ctx.deps.rerank_beta
+    n = len(hits)
+    cosines = np.fromiter((h.score for h in hits), dtype=np.float32, count=n)
+    overlaps = np.fromiter((_jaccard(h.payload.get("tag_set") or [], ref_tags) for h in hits),
+                           dtype=np.float32, count=n)
+    combined = alpha * cosines + beta * overlaps
+    # Stable sort keeps Qdrant's order among ties, as list.sort did
+    order = np.argsort(-combined, kind="stable")
+    print(f"{log_prefix} reranked with alpha={alpha} beta={beta} ref_tags={len(ref_tags)}")
+    return [hits[i].payload | {"cosine": hits[i].score, "combined_score": float(combined[i])} for i in order]
+
 @rag_agent.tool
 async def rag_search(ctx: RunContext[Deps], query_text: str, prefer_tags: Optional[List[str]] = None, k: int = 8) -> List[dict]:
     print(f"[tool.rag_search] q='{query_text[:60]}...' k={k}")
-    qvec = embed_texts([query_text])[0]
+    qvec = embed_query(query_text)
     scope_filter = build_scope_filter(ctx.deps.scope, ctx.deps.seed_video_id, ctx.deps.seed_channel_id,
                                       ctx.deps.allowed_video_ids)
     hits = query(qvec, must_tags=None, top_k=k, query_filter=scope_filter)    
     print(f"[tool.rag_search] raw hits={len(hits)}")
 
-    results = [h.payload | {"cosine": h.score} for h in hits]
-
-    # --- Tag-aware re-rank ---
-    if ctx.deps.tag_rerank:
-        ref_tags = prefer_tags or ctx.deps.seed_tags or []
-        alpha, beta = ctx.deps.rerank_alpha, ctx.deps.rerank_beta
-        for r in results:
-            overlap = _jaccard(r.get("tag_set") or [], ref_tags)
-            r["combined_score"] = alpha * float(r["cosine"]) + beta * overlap
-        results.sort(key=lambda r: r.get("combined_score", r["cosine"]), reverse=True)
-        print(f"[tool.rag_search] reranked with alpha={alpha} beta={beta} ref_tags={len(ref_tags)}")
+    results = _rerank(ctx, hits, prefer_tags)
 
     # Return top-k (already small) with scores included
     print(f"[tool.rag_search] returning {min(len(results), k)} results")
     return results
+
+@rag_agent.tool
+async def rag_search_batch(ctx: RunContext[Deps], query_texts: List[str], prefer_tags: Optional[List[str]] = None,
+                           k: int = 8) -> List[List[dict]]:
+    """Search several sub-questions at once; prefer this over repeated rag_search calls."""
+    print(f"[tool.rag_search_batch] n={len(query_texts)} k={k}")
+    if not query_texts:
+        return []
+    qvecs = embed_queries(query_texts)
+    scope_filter = build_scope_filter(ctx.deps.scope, ctx.deps.seed_video_id, ctx.deps.seed_channel_id,
+                                      ctx.deps.allowed_video_ids)
+    hit_lists = query_many(qvecs, must_tags=None, top_k=k, query_filter=scope_filter)
+    print(f"[tool.rag_search_batch] raw hits={[len(h) for h in hit_lists]}")
+    return [_rerank(ctx, hits, prefer_tags, log_prefix="[tool.rag_search_batch]") for hits in hit_lists]
@@ -1,5 +1,6 @@
+from dataclasses import dataclass
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 class VideoMeta(BaseModel):
     video_id: str
@@ -9,9 +10,12 @@ class VideoMeta(BaseModel):
     tags: List[str] = Field(default_factory=list)
     url: str
 
-class Chunk(BaseModel):
+# Internal hot-path struct: built once per chunk, so skip pydantic validation.
+# Metadata lives on the single VideoMeta for the video, referenced by video_id.
+@dataclass(slots=True)
+class Chunk:
     id: str
-    video: VideoMeta
+    video_id: str
     chunk_idx: int
     text: str
-    tag_set: List[str]
+    tag_set: Tuple[str, ...]
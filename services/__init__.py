@@ -1,5 +1,5 @@
 from .youtube import (get_transcript_text, normalize_tags, chunk_text, get_video_meta, 
     search_videos_by_tags, search_same_channel_videos, discover_by_tags_and_channel,
     list_channel_uploads)
-from .openai import infer_scope_llm, embed_texts
-from .store import upsert_chunks, query
\ No newline at end of file
+from .openai import infer_scope_llm, embed_texts, embed_query, embed_queries, EMBED_BATCH_SIZE
+from .store import upsert_chunks, query, query_many
\ No newline at end of file
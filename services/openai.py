@@ -1,11 +1,28 @@
 from openai import OpenAI
+import tiktoken
 import os
 import json
-from typing import List, Tuple
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 
-EMBED_MODEL = "text-embedding-3-large"  # 3072 dims
+EMBED_MODEL = "text-embedding-3-large"  # natively 3072 dims
+EMBED_DIM = 1024  # Matryoshka-truncated by the API; near-identical recall at a third of the size
 OPENAI_CHAT_MODEL = "gpt-5"
 
+# Chunk size per embedding model, well inside each model's 8191-token input window.
+# Only v3 models are listed: embed_texts always sends `dimensions`, which ada-002 rejects.
+MODEL_MAX_CHARS = {
+    "text-embedding-3-large": 6000,
+    "text-embedding-3-small": 6000,
+}
+CHUNK_MAX_CHARS = MODEL_MAX_CHARS.get(EMBED_MODEL, 1000)
+CHUNK_OVERLAP = CHUNK_MAX_CHARS * 3 // 20  # keep the original 15% overlap ratio
+# Per-request API caps: 2048 inputs and 300k tokens. Requests are packed by real
+# token count (tiktoken), leaving some headroom under the token cap.
+EMBED_BATCH_SIZE = 2048
+EMBED_MAX_REQUEST_TOKENS = 250_000
+
 SCOPE_VALUES = {"one_video", "seed_plus_tag", "seed_plus_channel", "any"}
 
 SYSTEM_PROMPT = """
@@ -79,10 +96,66 @@ def infer_scope_llm(question: str, seed_title: str = "", seed_tags: list[str] =
     except Exception as e:
         return "any", "Fallback due to parsing or API error."
 
+_encoding = None
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(EMBED_MODEL)
+        except KeyError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+def _request_batches(texts: List[str]) -> List[Tuple[int, int]]:
+    """Split texts into [start, end) ranges that fit the per-request input and token caps."""
+    counts = [len(toks) for toks in _get_encoding().encode_ordinary_batch(texts)]
+    batches, start, tokens = [], 0, 0
+    for i, n in enumerate(counts):
+        if i > start and (i - start >= EMBED_BATCH_SIZE or tokens + n > EMBED_MAX_REQUEST_TOKENS):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
 def embed_texts(texts: List[str]) -> List[List[float]]:
     print(f"[embed] creating embeddings for {len(texts)} texts using {EMBED_MODEL}")
     oai = _get_openai_client()
-    resp = oai.embeddings.create(model=EMBED_MODEL, input=texts)
-    vecs = [d.embedding for d in resp.data]
+    vecs: List[List[float]] = []
+    for start, end in _request_batches(texts):
+        resp = oai.embeddings.create(model=EMBED_MODEL, input=texts[start:end], dimensions=EMBED_DIM)
+        vecs.extend(d.embedding for d in resp.data)
     print(f"[embed] embeddings ready: {len(vecs)} vectors")
     return vecs
+
+# Query embeddings keyed by (model, text); vectors are stored as tuples so callers can't mutate them
+_QUERY_CACHE_SIZE = 2048
+_query_cache: "OrderedDict[Tuple[str, str], Tuple[float, ...]]" = OrderedDict()  # LRU order
+_query_cache_lock = threading.Lock()
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """Embed search queries, serving repeats from an in-process LRU cache and embedding misses in one call."""
+    found: Dict[str, Tuple[float, ...]] = {}
+    # Copy hits out before inserting anything, so eviction below can't drop a vector we still need
+    with _query_cache_lock:
+        for t in texts:
+            key = (EMBED_MODEL, t)
+            if key in _query_cache:
+                _query_cache.move_to_end(key)
+                found[t] = _query_cache[key]
+    misses = [t for t in dict.fromkeys(texts) if t not in found]
+    if misses:
+        vecs = embed_texts(misses)
+        with _query_cache_lock:
+            for text, vec in zip(misses, vecs):
+                found[text] = _query_cache[(EMBED_MODEL, text)] = tuple(vec)
+                _query_cache.move_to_end((EMBED_MODEL, text))
+                if len(_query_cache) > _QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)  # evict least recently used
+    print(f"[embed] query embeddings: {len(misses)} new of {len(texts)} requested")
+    return [list(found[t]) for t in texts]
+
+def embed_query(text: str) -> List[float]:
+    """Embed a single search query; repeated queries are served from an in-process cache."""
+    return embed_queries([text])[0]
@@ -1,19 +1,33 @@
-import os, time, uuid
+import os, time, uuid, threading
 from typing import List, Optional
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchAny
-from models import Chunk
+from qdrant_client.models import (Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchAny,
+    QueryRequest, BinaryQuantization, BinaryQuantizationConfig, SearchParams, QuantizationSearchParams,
+    PayloadSchemaType)
+from models import Chunk, VideoMeta
+from .openai import EMBED_DIM
 
 
 COLLECTION = "youtube_rag"
-DIM = 3072
+UPSERT_BATCH_SIZE = 16  # ~6000-char chunks: a typical video spans several batches
+# Payload fields used by scope/tag filters; indexed so filtering doesn't scan every point
+KEYWORD_INDEX_FIELDS = ("video_id", "channel_id", "tag_set")
+DIM = EMBED_DIM
+# Coarse search runs on 1-bit vectors; oversampled candidates are rescored with the fp32 originals
+SEARCH_PARAMS = SearchParams(
+    quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0)
+)
 
 _client = None
+_collection_lock = threading.Lock()  # indexing threads may race on first creation
+_collection_ready = False
 def _make_client() -> QdrantClient:
     url = os.getenv("QDRANT_URL", "http://localhost:6333")
     api_key = os.getenv("QDRANT_API_KEY")
-    print(f"[qdrant] connecting to {url}")
-    return QdrantClient(url=url, api_key=api_key)
+    grpc_port = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    print(f"[qdrant] connecting to {url} (grpc port {grpc_port})")
+    # gRPC sends vectors as packed floats instead of JSON text
+    return QdrantClient(url=url, api_key=api_key, prefer_grpc=True, grpc_port=grpc_port, timeout=30)
 
 def _get_client() -> QdrantClient:
     global _client
@@ -39,42 +53,64 @@ def _wait_for_ready(timeout_s: int = 15):
     ) from last_err
 
 def ensure_collection():
+    global _collection_ready
+    if _collection_ready:
+        return
     _wait_for_ready()
-    names = [c.name for c in _get_client().get_collections().collections]
-    if COLLECTION not in names:
-        print(f"[qdrant] creating collection '{COLLECTION}' size={DIM}")
-        _get_client().recreate_collection(
-            collection_name=COLLECTION,
-            vectors_config=VectorParams(size=DIM, distance=Distance.COSINE),
-        )
-    else:
-        print(f"[qdrant] collection '{COLLECTION}' is ready")
+    with _collection_lock:
+        if _collection_ready:
+            return
+        names = [c.name for c in _get_client().get_collections().collections]
+        if COLLECTION in names:
+            size = _get_client().get_collection(COLLECTION).config.params.vectors.size
+            if size != DIM:
+                # Vectors of a different size can't be mixed in; drop and re-index from scratch
+                print(f"[qdrant] collection '{COLLECTION}' has size={size}, expected {DIM}; recreating")
+                names.remove(COLLECTION)
+        if COLLECTION not in names:
+            print(f"[qdrant] creating collection '{COLLECTION}' size={DIM}")
+            _get_client().recreate_collection(
+                collection_name=COLLECTION,
+                vectors_config=VectorParams(size=DIM, distance=Distance.COSINE),
+                quantization_config=BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True)),
+            )
+        else:
+            print(f"[qdrant] collection '{COLLECTION}' is ready")
+        # Idempotent: re-creating an existing index with the same schema is a no-op
+        for field in KEYWORD_INDEX_FIELDS:
+            _get_client().create_payload_index(
+                collection_name=COLLECTION, field_name=field, field_schema=PayloadSchemaType.KEYWORD,
+            )
+        _collection_ready = True
 
-def upsert_chunks(chunks: List[Chunk], vectors: List[List[float]]):
+def upsert_chunks(meta: VideoMeta, chunks: List[Chunk], vectors: List[List[float]]):
     ensure_collection()
     print(f"[qdrant] upserting {len(chunks)} chunks")
     points = []
     for ch, vec in zip(chunks, vectors):
         # Qdrant requires point IDs to be UUID or unsigned int. Use deterministic UUIDv5 as string.
-        point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"yt::{ch.video.video_id}::{ch.chunk_idx}"))
+        point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"yt::{ch.video_id}::{ch.chunk_idx}"))
         payload = {
-            "video_id": ch.video.video_id,
-            "title": ch.video.title,
-            "channel": ch.video.channel,
-            "channel_id": ch.video.channel_id,
-            "tags": ch.video.tags,
-            "tag_set": ch.tag_set,
+            "video_id": ch.video_id,
+            "title": meta.title,
+            "channel": meta.channel,
+            "channel_id": meta.channel_id,
+            "tags": meta.tags,
+            "tag_set": list(ch.tag_set),
             "chunk_idx": ch.chunk_idx,
-            "url": ch.video.url,
+            "url": meta.url,
             "text": ch.text,
             "orig_id": ch.id,
         }
         points.append(PointStruct(id=point_id, vector=vec, payload=payload))
-    _get_client().upsert(collection_name=COLLECTION, points=points)
+    # Stream batches without waiting for indexing; Qdrant applies updates in order, so
+    # waiting on the last batch guarantees all of them are searchable when we return.
+    for i in range(0, len(points), UPSERT_BATCH_SIZE):
+        last = i + UPSERT_BATCH_SIZE >= len(points)
+        _get_client().upsert(collection_name=COLLECTION, points=points[i:i + UPSERT_BATCH_SIZE], wait=last)
     print("[qdrant] upsert complete")
 
-def query(qvec: List[float], must_tags: Optional[List[str]] = None, top_k=8, query_filter: Optional[Filter]=None):
-    ensure_collection()
+def _with_tag_filter(query_filter: Optional[Filter], must_tags: Optional[List[str]]) -> Optional[Filter]:
     flt = query_filter
     if must_tags:
         tag_filter = Filter(must=[FieldCondition(key="tag_set", match=MatchAny(any=must_tags))])
@@ -82,7 +118,28 @@ def query(qvec: List[float], must_tags: Optional[List[str]] = None, top_k=8, que
             flt = Filter(must=(flt.must + tag_filter.must))
         else:
             flt = tag_filter
+    return flt
+
+def query(qvec: List[float], must_tags: Optional[List[str]] = None, top_k=8, query_filter: Optional[Filter]=None):
+    ensure_collection()
+    flt = _with_tag_filter(query_filter, must_tags)
     print(f"[qdrant] query top_k={top_k} filtered={bool(must_tags)}")
-    hits = _get_client().search(collection_name=COLLECTION, query_vector=qvec, limit=top_k, query_filter=flt)
+    hits = _get_client().search(collection_name=COLLECTION, query_vector=qvec, limit=top_k, query_filter=flt,
+                                search_params=SEARCH_PARAMS)
     print(f"[qdrant] query hits={len(hits)}")
     return hits
+
+def query_many(qvecs: List[List[float]], must_tags: Optional[List[str]] = None, top_k=8,
+               query_filter: Optional[Filter]=None):
+    """Answer several query vectors in a single Qdrant round-trip; returns one hit list per vector."""
+    if not qvecs:
+        return []
+    ensure_collection()
+    flt = _with_tag_filter(query_filter, must_tags)
+    print(f"[qdrant] query_many n={len(qvecs)} top_k={top_k} filtered={bool(must_tags)}")
+    requests = [QueryRequest(query=v, filter=flt, limit=top_k, params=SEARCH_PARAMS, with_payload=True)
+                for v in qvecs]
+    responses = _get_client().query_batch_points(collection_name=COLLECTION, requests=requests)
+    hits = [r.points for r in responses]
+    print(f"[qdrant] query_many hits={[len(h) for h in hits]}")
+    return hits
@@ -2,39 +2,54 @@ import re
 import time
 import json
 import os
+import shelve
 import threading
-from typing import Iterable, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+from typing import Iterable, List, Tuple
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
 
 from googleapiclient.errors import HttpError
 
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
 from models import VideoMeta
+from .openai import CHUNK_MAX_CHARS, CHUNK_OVERLAP
 
 YOUTUBE_WATCH_URL_TEMPLATE = "https://www.youtube.com/watch?v={video_id}"
 CHANNEL_ID_RE = re.compile(r"^UC[a-zA-Z0-9_-]{22}$")  # common UC... pattern
 
 
+@lru_cache(maxsize=4096)
+def _normalize_tags_cached(tags: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(sorted({re.sub(r"\s+", " ", t).strip().lower() for t in tags if t and t.strip()}))
+
 def normalize_tags(tags: Iterable[str]) -> List[str]:
-    return sorted({re.sub(r"\s+", " ", t).strip().lower() for t in tags if t and t.strip()})
+    # Cache holds immutable tuples; hand callers a fresh list they may mutate
+    return list(_normalize_tags_cached(tuple(tags or ())))
 
-def chunk_text(s: str, max_chars=1000, overlap=150) -> List[str]:
+@lru_cache(maxsize=256)
+def _chunk_text_cached(s: str, max_chars: int, overlap: int) -> Tuple[str, ...]:
     s = re.sub(r"\s+", " ", (s or "")).strip()
     if not s:
-        return []
+        return ()
     if len(s) <= max_chars:
-        return [s]
+        return (s,)
     # Ensure we always advance by at least 1 character
     effective_overlap = max(0, min(overlap, max_chars - 1))
     step = max_chars - effective_overlap
-    chunks, i = [], 0
-    while i < len(s):
-        end = min(len(s), i + max_chars)
-        chunks.append(s[i:end])
-        if end >= len(s):
-            break
-        i += step
-    return chunks
+    # Build every window's bounds in one vectorized op; the last window is the first to reach the end
+    n = len(s)
+    count = -(-(n - max_chars) // step) + 1
+    starts = np.arange(count, dtype=np.int64) * step
+    ends = np.minimum(starts + max_chars, n)
+    return tuple(s[a:b] for a, b in zip(starts.tolist(), ends.tolist()))
+
+def chunk_text(s: str, max_chars=CHUNK_MAX_CHARS, overlap=CHUNK_OVERLAP) -> List[str]:
+    return list(_chunk_text_cached(s or "", max_chars, overlap))
 
 # ----- Rate Limiter for YouTube Transcript API -----
 class TranscriptRateLimiter:
@@ -43,7 +58,7 @@ class TranscriptRateLimiter:
     def __init__(self, max_requests=5, time_window=10):
         self.max_requests = max_requests
         self.time_window = time_window
-        self.requests = []
+        self.requests = deque(maxlen=max_requests)  # FIFO: oldest timestamp at [0]
         self.lock = threading.Lock()
     
     def wait_if_needed(self):
@@ -52,7 +67,8 @@ class TranscriptRateLimiter:
             with self.lock:
                 now = time.perf_counter()
                 # Drop timestamps outside the window
-                self.requests = [t for t in self.requests if now - t < self.time_window]
+                while self.requests and now - self.requests[0] >= self.time_window:
+                    self.requests.popleft()
 
                 if len(self.requests) < self.max_requests:
                     # Record and proceed
@@ -60,7 +76,7 @@ class TranscriptRateLimiter:
                     return
 
                 # Need to wait until the oldest request falls out of the window
-                oldest = min(self.requests)
+                oldest = self.requests[0]
                 wait_time = max(0.0, self.time_window - (now - oldest))
 
             # Release lock while sleeping
@@ -79,7 +95,7 @@ def _get_ytt_api():
     return YouTubeTranscriptApi()
 
 
-def get_transcript_text(video_id: str) -> str:
+def _fetch_transcript_text(video_id: str) -> str:
     try:
         print(f"[transcript] fetching for {video_id}")
         
@@ -103,6 +119,34 @@ def get_transcript_text(video_id: str) -> str:
         print(f"[transcript] error for {video_id}; returning empty")
         return ""
 
+# In-process memo; like the disk cache it only keeps non-empty text, so an empty
+# result (which may be a transient fetch error) is retried on the next call
+_TRANSCRIPT_MEMO_SIZE = 1024
+_transcript_memo: dict = {}
+_transcript_memo_lock = threading.Lock()
+
+def _memo_transcript(video_id: str, text: str):
+    with _transcript_memo_lock:
+        if len(_transcript_memo) >= _TRANSCRIPT_MEMO_SIZE:
+            _transcript_memo.pop(next(iter(_transcript_memo)))  # evict oldest
+        _transcript_memo[video_id] = text
+
+def get_transcript_text(video_id: str) -> str:
+    text = _transcript_memo.get(video_id)
+    if text:
+        return text
+    # Disk hits skip the rate limiter entirely; empty results are never persisted
+    text = _video_cache_get(f"transcript:{video_id}")
+    if text:
+        print(f"[transcript] cache hit length={len(text)} for {video_id}")
+        _memo_transcript(video_id, text)
+        return text
+    text = _fetch_transcript_text(video_id)
+    if text:
+        _video_cache_put(f"transcript:{video_id}", text)
+        _memo_transcript(video_id, text)
+    return text
+
 # ----- TagCache -----
 CACHE_PATH = os.getenv("TAG_CACHE_PATH", "tag_cache.json")
 
@@ -122,15 +166,39 @@ def _save_cache(d):
     except Exception: 
         pass
 
+# ----- VideoCache (transcripts + metadata, keyed by video_id) -----
+VIDEO_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", "transcript_cache")
+_video_cache_lock = threading.Lock()  # shelve is not safe for concurrent access
+
+def _video_cache_get(key: str):
+    if not VIDEO_CACHE_PATH:
+        return None
+    try:
+        with _video_cache_lock, shelve.open(VIDEO_CACHE_PATH, flag='r') as db:
+            return db.get(key)
+    except Exception:
+        return None
+
+def _video_cache_put(key: str, value):
+    if not VIDEO_CACHE_PATH:
+        return
+    try:
+        with _video_cache_lock, shelve.open(VIDEO_CACHE_PATH) as db:
+            db[key] = value
+    except Exception:
+        pass
+
 _yt_client = None
+_yt_client_lock = threading.Lock()  # indexing threads may race on first use
 def _get_yt_client():
     global _yt_client
     youtube_api_key = os.getenv("YOUTUBE_API_KEY")
     if not youtube_api_key: 
         raise ValueError("YOUTUBE_API_KEY environment variable not set")
-    if not _yt_client:
-        _yt_client = build("youtube", "v3", developerKey=youtube_api_key, static_discovery=False, 
-                            cache_discovery=False)
+    with _yt_client_lock:
+        if not _yt_client:
+            _yt_client = build("youtube", "v3", developerKey=youtube_api_key, static_discovery=False, 
+                                cache_discovery=False)
     return _yt_client
 
 def get_uploads_playlist_id(channel_id: str) -> str:
@@ -161,10 +229,11 @@ def list_channel_uploads(channel_id: str, max_results: int = 25) -> list[str]:
             vids.append(vid)
     return vids
 
-def get_video_meta(video_id: str) -> VideoMeta:
+def _fetch_video_meta(video_id: str) -> VideoMeta:
     print(f"[yt] get_video_meta video_id={video_id}")
     yt_client = _get_yt_client()
-    resp = yt_client.videos().list(part="snippet", id=video_id).execute()
+    # Called from indexing worker threads; httplib2 transports aren't thread-safe
+    resp = yt_client.videos().list(part="snippet", id=video_id).execute(http=build_http())
     items = resp.get("items", [])
     if not items:
         raise ValueError(f"Video not found: {video_id}")
@@ -181,6 +250,34 @@ def get_video_meta(video_id: str) -> VideoMeta:
     print(f"[yt] title='{vm.title}' tags={len(vm.tags)} channel_id={vm.channel_id}")
     return vm
 
+@lru_cache(maxsize=1024)
+def get_video_meta(video_id: str) -> VideoMeta:
+    cached = _video_cache_get(f"meta:{video_id}")
+    if cached is not None:
+        print(f"[yt] meta cache hit video_id={video_id}")
+        return VideoMeta(**cached)
+    vm = _fetch_video_meta(video_id)
+    # Stored as a plain dict so the cache survives model changes that keep the same fields
+    _video_cache_put(f"meta:{video_id}", vm.model_dump())
+    return vm
+
+def _one_tag_search(t: str, max_per_tag: int) -> list[str]:
+    yt_client = _get_yt_client()
+    # httplib2 transports aren't thread-safe; give each concurrent request its own
+    resp = yt_client.search().list(
+        part="snippet",
+        type="video",
+        q=t,
+        maxResults=max_per_tag,
+        order="relevance",
+    ).execute(http=build_http())
+    vids = []
+    for item in resp.get("items", []):
+        vid = (item.get("id") or {}).get("videoId")
+        if vid:
+            vids.append(vid)
+    return vids
+
 def search_videos_by_tags(tags: list[str], max_per_tag: int = 5, max_search_calls: int = 2) -> list[str]:
     print(f"[search] search_videos_by_tags tags={len(tags or [])} max_per_tag={max_per_tag}")
     ids, calls = set(), 0
@@ -190,38 +287,41 @@ def search_videos_by_tags(tags: list[str], max_per_tag: int = 5, max_search_call
     if not tags:
         return []
 
-    for t in (tags or [])[:3]:
+    misses = []
+    for t in tags[:3]:
         key = f"{today}:{t}:{max_per_tag}"
         if key in cache:
             print(f"[search] cache hit for tag='{t}' -> {len(cache[key])} ids")
             ids.update(cache[key])
-            continue
-        if calls >= max_search_calls:
-            print("[search] reached max_search_calls; skipping further API calls")
-            continue
-        try:
-            yt_client = _get_yt_client()
-            resp = yt_client.search().list(
-                part="snippet",
-                type="video",
-                q=t,
-                maxResults=max_per_tag,
-                order="relevance",
-            ).execute()
-            calls += 1
-            vids = []
-            for item in resp.get("items", []):
-                vid = (item.get("id") or {}).get("videoId")
-                if vid:
-                    ids.add(vid); vids.append(vid)
-            cache[key] = vids
-        except HttpError as e:
-            if getattr(e, "resp", None) and e.resp.status == 403 and b"quota" in getattr(e, "content", b"").lower():
-                print("[search] quota exceeded; stopping tag searches for today")
+        else:
+            misses.append(t)
+    # Each search.list is an independent ~200-500ms round-trip; issue them concurrently.
+    # Like the sequential loop, only successful calls count toward max_search_calls:
+    # failed (non-quota) searches are refilled from the remaining misses in another round.
+    pending = iter(misses)
+    quota_hit = False
+    with ThreadPoolExecutor(max_workers=max(1, min(len(misses), max_search_calls))) as ex:
+        while not quota_hit:
+            to_fetch = list(islice(pending, max(0, max_search_calls - calls)))
+            if not to_fetch:
                 break
-            else:
-                print(f"[search] http error on tag='{t}', continuing")
-                continue
+            futs = {ex.submit(_one_tag_search, t, max_per_tag): t for t in to_fetch}
+            for f in as_completed(futs):
+                t = futs[f]
+                try:
+                    vids = f.result()
+                except HttpError as e:
+                    if getattr(e, "resp", None) and e.resp.status == 403 and b"quota" in getattr(e, "content", b"").lower():
+                        print("[search] quota exceeded; stopping tag searches for today")
+                        quota_hit = True
+                    else:
+                        print(f"[search] http error on tag='{t}', continuing")
+                    continue
+                calls += 1
+                ids.update(vids)
+                cache[f"{today}:{t}:{max_per_tag}"] = vids
+    if not quota_hit and next(pending, None) is not None:
+        print("[search] reached max_search_calls; skipping further API calls")
 
     _save_cache(cache)
     print(f"[search] total tag-based ids={len(ids)} api_calls={calls}")